@@ -3,20 +3,34 @@ Jewelry Store — Application Factory (Vercel-compatible)
 """
 
 import os
-from flask import Flask
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, current_app, request
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
-from dotenv import load_dotenv
+from sqlalchemy import event, text
+from sqlalchemy.pool import NullPool
 
-load_dotenv()
+# Vercel injects the environment itself and ships no .env, so skip the
+# import and file lookup there.  Everywhere else — production included,
+# where the README has operators put SECRET_KEY / DATABASE_URL in .env —
+# load it without overriding variables that are already exported.
+if not os.environ.get("VERCEL"):
+    from dotenv import load_dotenv
+    load_dotenv(override=False)
 
 db = SQLAlchemy()
 login_manager = LoginManager()
 csrf = CSRFProtect()
 
 
-def create_app():
+def create_app(vercel: bool | None = None):
+    """
+    Build the application.  `vercel` defaults to detecting the VERCEL=1
+    environment variable; pass it explicitly to exercise either code path
+    (e.g. from tests) without touching the environment.
+    """
+    is_vercel = os.environ.get("VERCEL") == "1" if vercel is None else vercel
     app = Flask(__name__, instance_relative_config=False)
 
     # ------------------------------------------------------------------
@@ -29,8 +43,22 @@ def create_app():
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16 MB
 
+    # Connection pool — serverless invocations are short-lived, so don't
+    # hold connections open; long-running workers get a bounded pool that
+    # recycles and pings connections to survive idle periods.
+    uri = app.config["SQLALCHEMY_DATABASE_URI"]
+    if is_vercel:
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"poolclass": NullPool}
+    elif uri not in ("sqlite://", "sqlite:///:memory:"):
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            "pool_size":     10,
+            "max_overflow":  5,
+            "pool_timeout":  30,
+            "pool_recycle":  1800,
+            "pool_pre_ping": True,
+        }
+
     # On Vercel only /tmp is writable; locally use app/static/uploads
-    is_vercel = os.environ.get("VERCEL") == "1"
     if is_vercel:
         upload_folder = "/tmp/uploads"
     else:
@@ -39,37 +67,234 @@ def create_app():
     app.config["UPLOAD_FOLDER"] = upload_folder
     os.makedirs(upload_folder, exist_ok=True)
 
+    # Background work (image resizing, …) needs a long-lived process; on
+    # Vercel the function may be frozen once the response is sent.
+    app.executor = None if is_vercel else ThreadPoolExecutor(max_workers=2)
+
+    # Compact msgpack session cookies when msgpack is installed
+    try:
+        from app.sessions import MsgpackSessionInterface
+    except ImportError:
+        pass
+    else:
+        app.session_interface = MsgpackSessionInterface()
+
     # ------------------------------------------------------------------
-    # Initialise extensions (no Flask-Migrate — not needed on Vercel)
+    # Initialise extensions (Flask-Migrate only off Vercel, if installed)
     # ------------------------------------------------------------------
     db.init_app(app)
     login_manager.init_app(app)
     csrf.init_app(app)
 
+    if not is_vercel:
+        try:
+            from flask_migrate import Migrate
+        except ImportError:
+            pass
+        else:
+            Migrate(app, db)
+
+    if uri.startswith("sqlite"):
+        with app.app_context():
+            event.listen(db.engine, "connect", _set_sqlite_pragmas)
+
     login_manager.login_view = "admin_bp.login"
     login_manager.login_message = "Please log in to access the admin panel."
     login_manager.login_message_category = "warning"
 
     # ------------------------------------------------------------------
-    # Register blueprints
+    # Register blueprints (skipped for bare health-check instances, which
+    # then never import the routes, forms, or Pillow)
     # ------------------------------------------------------------------
+    if os.environ.get("VERCEL_HEALTHCHECK") != "1":
+        _register_blueprints(app)
+
+    # ------------------------------------------------------------------
+    # Create tables and seed defaults (once per container / database)
+    # ------------------------------------------------------------------
+    try:
+        _init_db_once(app)
+    except Exception as e:
+        app.logger.warning(f"DB init warning: {e}")
+
+    return app
+
+
+def _register_blueprints(app):
     from app.main import main_bp
     from app.admin import admin_bp
 
     app.register_blueprint(main_bp)
     app.register_blueprint(admin_bp, url_prefix="/admin")
 
-    # ------------------------------------------------------------------
-    # Create tables and seed defaults
-    # ------------------------------------------------------------------
+    @app.after_request
+    def _sandbox_uploaded_svg(response):
+        # Uploaded SVGs are untrusted markup: even if one slips past the
+        # upload screen, opening it directly must not run script
+        if request.path.startswith("/static/uploads/") and request.path.endswith(".svg"):
+            response.headers["Content-Security-Policy"] = (
+                "default-src 'none'; style-src 'unsafe-inline'; sandbox"
+            )
+            response.headers["X-Content-Type-Options"] = "nosniff"
+        return response
+
+    # Upload resizing is much slower without Pillow's SIMD JPEG codec
+    from PIL import features
+    if not features.check_feature("libjpeg_turbo"):
+        app.logger.warning("Pillow is not linked against libjpeg-turbo; "
+                           "JPEG uploads will resize slowly.")
+
+
+def _set_sqlite_pragmas(dbapi_conn, _record):
+    # WAL lets readers proceed during writes; NORMAL sync drops the fsync
+    # on every commit (still durable across application crashes).
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.execute("PRAGMA mmap_size=268435456")
+    cur.execute("PRAGMA cache_size=-20000")
+    cur.close()
+
+
+# SQLite under /tmp lives as long as the container does, so a marker file
+# next to it lets warm invocations skip schema work.  Durable databases
+# are tracked per-process instead.
+_DB_INIT_MARKER = "/tmp/.jewelry_db_initialized"
+_initialized_uris = set()
+
+
+def init_db(app):
+    """Create all tables and seed default settings.
+
+    Safe to run repeatedly; call it once at deploy time to keep the
+    work off the first request entirely.
+    """
     with app.app_context():
-        try:
-            db.create_all()
-            _seed_defaults()
-        except Exception as e:
-            app.logger.warning(f"DB init warning: {e}")
+        db.create_all()
+        _ensure_indexes()
+        _ensure_search_indexes()
+        _ensure_json_columns()
+        _seed_defaults()
 
-    return app
+
+def _init_db_once(app):
+    uri = app.config["SQLALCHEMY_DATABASE_URI"]
+    if uri in _initialized_uris:
+        return
+
+    tmp_sqlite = uri.startswith("sqlite:////tmp/")
+    if tmp_sqlite:
+        db_path = uri[len("sqlite:///"):]
+        if os.path.exists(_DB_INIT_MARKER) and os.path.exists(db_path):
+            _initialized_uris.add(uri)
+            return
+
+    init_db(app)
+    _initialized_uris.add(uri)
+    if tmp_sqlite:
+        open(_DB_INIT_MARKER, "w").close()
+
+
+def _ensure_indexes():
+    # create_all() skips tables that already exist, so indexes added to the
+    # models later would never reach an existing database without this.
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+# Full-text search: FTS5 shadow tables on SQLite, trigram GIN indexes on
+# PostgreSQL (which let the existing ILIKE '%q%' filters use an index).
+SEARCH_TABLES = {
+    "products": ("name",),
+    "orders":   ("order_number", "customer_name", "customer_email"),
+}
+
+
+def _ensure_search_indexes():
+    dialect = db.engine.dialect.name
+    try:
+        if dialect == "sqlite":
+            for table, columns in SEARCH_TABLES.items():
+                _ensure_fts5_table(table, columns)
+        elif dialect == "postgresql":
+            db.session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            for table, columns in SEARCH_TABLES.items():
+                ops = ", ".join(f"{c} gin_trgm_ops" for c in columns)
+                db.session.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{table}_search_trgm "
+                    f"ON {table} USING gin ({ops})"
+                ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.warning(f"Search index setup skipped: {e}")
+
+
+def _ensure_fts5_table(table, columns):
+    fts = f"{table}_fts"
+    cols = ", ".join(columns)
+    new_cols = ", ".join(f"new.{c}" for c in columns)
+    old_cols = ", ".join(f"old.{c}" for c in columns)
+    exists = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :n"),
+        {"n": fts},
+    ).first()
+
+    db.session.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} "
+        f"USING fts5({cols}, content='{table}', content_rowid='id')"
+    ))
+    db.session.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+    ))
+    db.session.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); END"
+    ))
+    db.session.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+    ))
+    if not exists:
+        # Index the rows that predate the shadow table
+        db.session.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+
+def _ensure_json_columns():
+    # products.extra_content used to be TEXT holding a JSON string.  SQLite
+    # keeps JSON as text, so only unparseable rows need clearing; PostgreSQL
+    # converts the column to JSONB once, nulling unparseable rows on the way
+    # so one bad legacy value cannot leave the column TEXT.
+    dialect = db.engine.dialect.name
+    try:
+        if dialect == "sqlite":
+            db.session.execute(text(
+                "UPDATE products SET extra_content = NULL "
+                "WHERE extra_content IS NOT NULL AND json_valid(extra_content) = 0"
+            ))
+        elif dialect == "postgresql":
+            data_type = db.session.execute(text(
+                "SELECT data_type FROM information_schema.columns "
+                "WHERE table_name = 'products' AND column_name = 'extra_content'"
+            )).scalar()
+            if data_type == "text":
+                db.session.execute(text(
+                    "CREATE FUNCTION pg_temp.try_jsonb(value text) RETURNS jsonb "
+                    "LANGUAGE plpgsql AS $$ BEGIN RETURN value::jsonb; "
+                    "EXCEPTION WHEN others THEN RETURN NULL; END $$"
+                ))
+                db.session.execute(text(
+                    "ALTER TABLE products ALTER COLUMN extra_content "
+                    "TYPE jsonb USING pg_temp.try_jsonb(extra_content)"
+                ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.warning(f"extra_content conversion skipped: {e}")
 
 
 def _seed_defaults():
@@ -88,16 +313,20 @@ def _seed_defaults():
         "contact_phone": "",
         "instagram_url": "",
         "facebook_url": "",
+        "settings:version": "0",
     }
 
-    for key, value in defaults.items():
-        try:
-            if not SiteSettings.query.filter_by(key=key).first():
-                db.session.add(SiteSettings(key=key, value=value))
-        except Exception:
-            pass
+    # One SELECT for the keys already present, one bulk INSERT for the rest
+    existing = {
+        k for (k,) in db.session.query(SiteSettings.key)
+                                .filter(SiteSettings.key.in_(defaults)).all()
+    }
+    rows = [{"key": k, "value": v} for k, v in defaults.items() if k not in existing]
+    if not rows:
+        return
 
     try:
+        db.session.bulk_insert_mappings(SiteSettings, rows)
         db.session.commit()
     except Exception:
         db.session.rollback()
@@ -5,22 +5,37 @@ Full admin portal: authentication, product management, order management,
 category management, and site-wide settings (logo, background, delivery).
 """
 
+import hmac
 import json
+import secrets
+import time
 from datetime import datetime, timezone
 
 from flask import (
     Blueprint, render_template, redirect, url_for,
-    request, flash, abort, current_app,
+    request, flash, abort, current_app, g, session, jsonify,
 )
 from flask_login import login_user, logout_user, login_required, current_user
-
-from app import db
-from app.models import Admin, Product, Category, Order, SiteSettings, ORDER_STATUSES
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import lazyload
+
+from app import db, csrf
+from app.models import (
+    Admin, Product, Category, Order, SiteSettings, ORDER_STATUSES,
+    COUNTER_ACTIVE_PRODUCTS, COUNTER_TOTAL_ORDERS, COUNTER_PENDING_ORDERS,
+    COUNTER_KEYS, product_list_options, get_counters, seed_counters,
+    bump_counter,
+)
 from app.forms import (
     LoginForm, CategoryForm, ProductForm,
     OrderStatusForm, SiteSettingsForm, ChangePasswordForm,
 )
-from app.utils import slugify, save_image, delete_image, get_settings
+from app.utils import (
+    slugify, save_image, save_image_async, delete_image, schedule_delete_image,
+    get_settings, keyset_paginate, invalidate_settings_cache, fts_match_ids,
+    invalidate_product_lists, invalidate_category_slugs, IMAGE_QUEUED,
+)
 
 admin_bp = Blueprint("admin_bp", __name__, template_folder="../templates/admin")
 
@@ -29,14 +44,37 @@ admin_bp = Blueprint("admin_bp", __name__, template_folder="../templates/admin")
 # Context processor — inject pending_count into every admin template
 # ---------------------------------------------------------------------------
 
-@admin_bp.context_processor
-def inject_admin_globals():
-    from app.models import Order as Ord
+# The sidebar badge tolerates a few seconds of staleness, so the count is
+# shared across requests for a short TTL and memoised on `g` per request.
+PENDING_COUNT_TTL = 10  # seconds
+_pending_cache = {"value": None, "expires": 0.0}
+
+
+def _pending_count() -> int:
+    now = time.monotonic()
+    if _pending_cache["value"] is not None and now < _pending_cache["expires"]:
+        return _pending_cache["value"]
     try:
-        pending = Ord.query.filter_by(status="pending").count()
+        value = get_counters().get(COUNTER_PENDING_ORDERS)
+        if value is None:
+            value = Order.query.filter_by(status="pending").count()
     except Exception:
-        pending = 0
-    return {"pending_count": pending}
+        return 0
+    _pending_cache.update(value=value, expires=now + PENDING_COUNT_TTL)
+    return value
+
+
+def _invalidate_pending_count() -> None:
+    _pending_cache["value"] = None
+    g.pop("_pending_count", None)
+
+
+@admin_bp.context_processor
+def inject_admin_globals():
+    cached = getattr(g, "_pending_count", None)
+    if cached is None:
+        cached = g._pending_count = _pending_count()
+    return {"pending_count": cached, "admin_token": _admin_token}
 
 
 # ---------------------------------------------------------------------------
@@ -47,6 +85,72 @@ def _redirect_back(fallback="admin_bp.dashboard"):
     return redirect(request.referrer or url_for(fallback))
 
 
+# Category dropdown choices change only when categories are added or
+# removed; those endpoints invalidate, the TTL covers other workers.
+CATEGORY_CHOICES_TTL = 60  # seconds
+_cat_choices_cache = {"value": None, "expires": 0.0}
+
+
+def _category_choices() -> list:
+    cached = getattr(g, "_cat_choices", None)
+    if cached is not None:
+        return cached
+
+    now = time.monotonic()
+    cached = _cat_choices_cache["value"]
+    if cached is None or now >= _cat_choices_cache["expires"]:
+        rows = (db.session.query(Category.id, Category.name)
+                .order_by(Category.name).all())
+        cached = [(0, "— No Category —")] + [(cid, name) for cid, name in rows]
+        _cat_choices_cache.update(value=cached, expires=now + CATEGORY_CHOICES_TTL)
+
+    g._cat_choices = cached
+    return cached
+
+
+def _invalidate_category_choices() -> None:
+    _cat_choices_cache["value"] = None
+    g.pop("_cat_choices", None)
+
+
+# Lightweight per-session token for the high-frequency toggle endpoint —
+# a constant-time compare instead of a full CSRF token decode per click.
+ADMIN_TOKEN_KEY = "admin_token"
+
+
+def _admin_token() -> str:
+    token = session.get(ADMIN_TOKEN_KEY)
+    if not token:
+        token = session[ADMIN_TOKEN_KEY] = secrets.token_urlsafe(32)
+    return token
+
+
+def _check_admin_token() -> None:
+    expected = session.get(ADMIN_TOKEN_KEY, "")
+    sent = (request.headers.get("X-Admin-Token")
+            or request.form.get(ADMIN_TOKEN_KEY, ""))
+    if not expected or not hmac.compare_digest(sent, expected):
+        abort(403)
+
+
+def _insert_with_unique_slug(obj) -> bool:
+    """
+    Insert a new Category/Product, relying on the unique slug constraint.
+    On a clash the slug gets a random suffix and the insert is retried
+    once.  Returns False if it still violates a constraint.
+    """
+    for attempt in range(2):
+        if attempt:
+            obj.slug = f"{obj.slug}-{secrets.token_hex(2)}"
+        db.session.add(obj)
+        try:
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+    return False
+
+
 # ---------------------------------------------------------------------------
 # Auth
 # ---------------------------------------------------------------------------
@@ -60,9 +164,20 @@ def login():
     if form.validate_on_submit():
         admin = Admin.query.filter_by(username=form.username.data).first()
         if admin and admin.is_active and admin.check_password(form.password.data):
+            if admin.needs_rehash():
+                # Upgrade legacy PBKDF2 hashes now that we have the password
+                admin.set_password(form.password.data)
+                db.session.commit()
             login_user(admin, remember=form.remember.data)
-            admin.last_login = datetime.now(timezone.utc)
-            db.session.commit()
+            session[ADMIN_TOKEN_KEY] = secrets.token_urlsafe(32)
+
+            # Don't hold the redirect on the last_login write where a
+            # background worker is available
+            app = current_app._get_current_object()
+            if app.executor is not None:
+                app.executor.submit(_stamp_last_login_in_background, app, admin.id)
+            else:
+                _stamp_last_login(admin.id)
             flash(f"Welcome back, {admin.username}!", "success")
             next_page = request.args.get("next")
             return redirect(next_page or url_for("admin_bp.dashboard"))
@@ -71,6 +186,23 @@ def login():
     return render_template("admin/login.html", form=form)
 
 
+def _stamp_last_login(admin_id: int) -> None:
+    db.session.execute(
+        update(Admin)
+        .where(Admin.id == admin_id)
+        .values(last_login=datetime.now(timezone.utc))
+    )
+    db.session.commit()
+
+
+def _stamp_last_login_in_background(app, admin_id: int) -> None:
+    with app.app_context():
+        try:
+            _stamp_last_login(admin_id)
+        except Exception:
+            app.logger.exception("Could not record last_login")
+
+
 @admin_bp.route("/logout")
 @login_required
 def logout():
@@ -98,14 +230,29 @@ def change_password():
 # Dashboard
 # ---------------------------------------------------------------------------
 
+def _dashboard_counts() -> dict:
+    """
+    Read the maintained counters; if any are missing, seed them from a live
+    recount (models.seed_counters) for next time.
+    """
+    counts = get_counters()
+    if all(key in counts for key in COUNTER_KEYS):
+        return counts
+
+    counts = seed_counters()
+    db.session.commit()
+    return counts
+
+
 @admin_bp.route("/")
 @admin_bp.route("/dashboard")
 @login_required
 def dashboard():
+    counts = _dashboard_counts()
     stats = {
-        "total_products":  Product.query.filter_by(is_active=True).count(),
-        "total_orders":    Order.query.count(),
-        "pending_orders":  Order.query.filter_by(status="pending").count(),
+        "total_products":  counts[COUNTER_ACTIVE_PRODUCTS],
+        "total_orders":    counts[COUNTER_TOTAL_ORDERS],
+        "pending_orders":  counts[COUNTER_PENDING_ORDERS],
         "total_categories": Category.query.count(),
         "recent_orders":   Order.query.order_by(Order.created_at.desc()).limit(5).all(),
         "low_stock":       Product.query.filter(Product.stock < 5,
@@ -121,7 +268,14 @@ def dashboard():
 @admin_bp.route("/categories")
 @login_required
 def categories():
-    cats = Category.query.order_by(Category.sort_order, Category.name).all()
+    # Plain rows with the product count aggregated in the same query
+    cats = db.session.execute(
+        select(Category.id, Category.name, Category.slug, Category.sort_order,
+               func.count(Product.id).label("product_count"))
+        .outerjoin(Product, Product.category_id == Category.id)
+        .group_by(Category.id)
+        .order_by(Category.sort_order, Category.name)
+    ).all()
     form = CategoryForm()
     return render_template("admin/categories.html", categories=cats, form=form)
 
@@ -131,16 +285,15 @@ def categories():
 def category_add():
     form = CategoryForm()
     if form.validate_on_submit():
-        slug = slugify(form.name.data)
-        # ensure unique slug
-        if Category.query.filter_by(slug=slug).first():
-            slug = f"{slug}-{Category.query.count() + 1}"
         cat = Category(name=form.name.data,
-                       slug=slug,
+                       slug=slugify(form.name.data),
                        sort_order=form.sort_order.data or 0)
-        db.session.add(cat)
-        db.session.commit()
-        flash(f'Category "{cat.name}" created.', "success")
+        if _insert_with_unique_slug(cat):
+            _invalidate_category_choices()
+            invalidate_category_slugs()
+            flash(f'Category "{cat.name}" created.', "success")
+        else:
+            flash(f'A category named "{form.name.data}" already exists.', "danger")
     else:
         for errors in form.errors.values():
             for e in errors:
@@ -152,8 +305,13 @@ def category_add():
 @login_required
 def category_delete(cat_id):
     cat = Category.query.get_or_404(cat_id)
+    for product in cat.products:   # removed by the cascade below
+        schedule_delete_image(product.image)
     db.session.delete(cat)
     db.session.commit()
+    _invalidate_category_choices()
+    invalidate_category_slugs()
+    invalidate_product_lists()
     flash(f'Category "{cat.name}" deleted (products unassigned).', "warning")
     return redirect(url_for("admin_bp.categories"))
 
@@ -167,24 +325,36 @@ def category_delete(cat_id):
 def products():
     q       = request.args.get("q", "").strip()
     cat_id  = request.args.get("category", 0, type=int)
-    page    = request.args.get("page", 1, type=int)
 
-    query = Product.query
+    query = Product.query.options(*product_list_options())
     if q:
-        query = query.filter(Product.name.ilike(f"%{q}%"))
+        ids = fts_match_ids("products", q)
+        if ids is None:
+            query = query.filter(Product.name.ilike(f"%{q}%"))
+        else:
+            query = query.filter(Product.id.in_(ids))
     if cat_id:
         query = query.filter_by(category_id=cat_id)
 
-    products = query.order_by(Product.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
-    categories = Category.query.order_by(Category.name).all()
+    products = keyset_paginate(query, Product, per_page=20)
+    categories = db.session.execute(
+        select(Category.id, Category.name).order_by(Category.name)
+    ).all()
     return render_template("admin/products.html",
                            products=products,
                            categories=categories,
                            q=q, cat_id=cat_id)
 
 
+def _parse_extra_content(raw):
+    """Hidden-field JSON from the block editor → list for the JSON column."""
+    try:
+        blocks = json.loads(raw or "[]")
+    except ValueError:
+        return None
+    return blocks if isinstance(blocks, list) and blocks else None
+
+
 # ---------------------------------------------------------------------------
 # Products — add
 # ---------------------------------------------------------------------------
@@ -193,38 +363,42 @@ def products():
 @login_required
 def product_add():
     form = ProductForm()
-    # Populate category choices
-    form.category_id.choices = [(0, "— No Category —")] + [
-        (c.id, c.name) for c in Category.query.order_by(Category.name).all()
-    ]
+    form.category_id.choices = _category_choices()
 
     if form.validate_on_submit():
-        slug = slugify(form.name.data)
-        if Product.query.filter_by(slug=slug).first():
-            slug = f"{slug}-{Product.query.count() + 1}"
-
         image_path = save_image(form.image.data, "products") if form.image.data else None
+        if form.image.data and not image_path:
+            flash(f'"{form.image.data.filename}" could not be used as an image.',
+                  "danger")
+            return render_template("admin/product_form.html", form=form, product=None)
 
         product = Product(
             name             = form.name.data,
-            slug             = slug,
+            slug             = slugify(form.name.data),
             sku              = form.sku.data or None,
             category_id      = form.category_id.data or None,
             original_price   = form.original_price.data,
             discounted_price = form.discounted_price.data or None,
             deal_price       = form.deal_price.data or None,
             description      = form.description.data,
-            extra_content    = form.extra_content.data or None,
+            extra_content    = _parse_extra_content(form.extra_content.data),
             stock            = form.stock.data or 0,
             is_active        = form.is_active.data,
             is_deal          = form.is_deal.data,
             is_featured      = form.is_featured.data,
             image            = image_path,
         )
-        db.session.add(product)
-        db.session.commit()
-        flash(f'Product "{product.name}" created successfully.', "success")
-        return redirect(url_for("admin_bp.products"))
+        if _insert_with_unique_slug(product):
+            invalidate_product_lists()
+            flash(f'Product "{product.name}" created successfully.', "success")
+            return redirect(url_for("admin_bp.products"))
+        schedule_delete_image(image_path)
+        sku = form.sku.data
+        if sku and db.session.execute(
+                select(Product.id).where(Product.sku == sku)).first():
+            flash("A product with this SKU already exists.", "danger")
+        else:
+            flash("The product could not be saved. Please try again.", "danger")
 
     return render_template("admin/product_form.html", form=form, product=None)
 
@@ -238,18 +412,23 @@ def product_add():
 def product_edit(product_id):
     product = Product.query.get_or_404(product_id)
     form    = ProductForm(obj=product)
-    form.category_id.choices = [(0, "— No Category —")] + [
-        (c.id, c.name) for c in Category.query.order_by(Category.name).all()
-    ]
+    form.category_id.choices = _category_choices()
 
     if request.method == "GET":
         form.category_id.data = product.category_id or 0
+        form.extra_content.data = json.dumps(product.extra_content or [])
 
     if form.validate_on_submit():
-        # Handle image replacement
+        # Handle image replacement; a rejected upload keeps the current image
         if form.image.data:
-            delete_image(product.image)
-            product.image = save_image(form.image.data, "products")
+            image_path = save_image(form.image.data, "products")
+            if not image_path:
+                flash(f'"{form.image.data.filename}" could not be used as an image.',
+                      "danger")
+                return render_template("admin/product_form.html",
+                                       form=form, product=product)
+            schedule_delete_image(product.image)
+            product.image = image_path
 
         product.name             = form.name.data
         product.sku              = form.sku.data or None
@@ -258,13 +437,14 @@ def product_edit(product_id):
         product.discounted_price = form.discounted_price.data or None
         product.deal_price       = form.deal_price.data or None
         product.description      = form.description.data
-        product.extra_content    = form.extra_content.data or None
+        product.extra_content    = _parse_extra_content(form.extra_content.data)
         product.stock            = form.stock.data or 0
         product.is_active        = form.is_active.data
         product.is_deal          = form.is_deal.data
         product.is_featured      = form.is_featured.data
 
         db.session.commit()
+        invalidate_product_lists()
         flash(f'Product "{product.name}" updated.', "success")
         return redirect(url_for("admin_bp.products"))
 
@@ -275,16 +455,36 @@ def product_edit(product_id):
 # Products — toggle active / deal / featured (AJAX-friendly POST)
 # ---------------------------------------------------------------------------
 
+@csrf.exempt
 @admin_bp.route("/products/toggle/<int:product_id>/<field>", methods=["POST"])
 @login_required
 def product_toggle(product_id, field):
-    product = Product.query.get_or_404(product_id)
+    _check_admin_token()
     allowed = {"is_active", "is_deal", "is_featured"}
     if field not in allowed:
         abort(400)
-    setattr(product, field, not getattr(product, field))
+
+    # Flip the flag in the database: one UPDATE ... RETURNING, no ORM load
+    column = getattr(Product, field)
+    value = db.session.execute(
+        update(Product)
+        .where(Product.id == product_id)
+        .values({field: ~column})
+        .returning(column)
+    ).scalar_one_or_none()
+    if value is None:
+        abort(404)
+
+    # Statement-level updates bypass the mapper events that keep counters
+    if field == "is_active":
+        bump_counter(db.session.connection(), COUNTER_ACTIVE_PRODUCTS,
+                     1 if value else -1)
     db.session.commit()
-    return redirect(_redirect_back("admin_bp.products"))
+    invalidate_product_lists()
+
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({"field": field, "value": value})
+    return _redirect_back("admin_bp.products")
 
 
 # ---------------------------------------------------------------------------
@@ -295,10 +495,11 @@ def product_toggle(product_id, field):
 @login_required
 def product_delete(product_id):
     product = Product.query.get_or_404(product_id)
-    delete_image(product.image)
+    schedule_delete_image(product.image)
     name = product.name
     db.session.delete(product)
     db.session.commit()
+    invalidate_product_lists()
     flash(f'Product "{name}" deleted.', "warning")
     return redirect(url_for("admin_bp.products"))
 
@@ -311,24 +512,25 @@ def product_delete(product_id):
 @login_required
 def orders():
     status = request.args.get("status", "")
-    page   = request.args.get("page", 1, type=int)
     q      = request.args.get("q", "").strip()
 
     query = Order.query
     if status and status in ORDER_STATUSES:
         query = query.filter_by(status=status)
     if q:
-        query = query.filter(
-            db.or_(
-                Order.order_number.ilike(f"%{q}%"),
-                Order.customer_name.ilike(f"%{q}%"),
-                Order.customer_email.ilike(f"%{q}%"),
+        ids = fts_match_ids("orders", q)
+        if ids is None:
+            query = query.filter(
+                db.or_(
+                    Order.order_number.ilike(f"%{q}%"),
+                    Order.customer_name.ilike(f"%{q}%"),
+                    Order.customer_email.ilike(f"%{q}%"),
+                )
             )
-        )
+        else:
+            query = query.filter(Order.id.in_(ids))
 
-    orders = query.order_by(Order.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    orders = keyset_paginate(query, Order, per_page=20)
     return render_template("admin/orders.html",
                            orders=orders,
                            active_status=status,
@@ -343,17 +545,26 @@ def orders():
 @admin_bp.route("/orders/<int:order_id>", methods=["GET", "POST"])
 @login_required
 def order_detail(order_id):
-    order = Order.query.get_or_404(order_id)
-    form  = OrderStatusForm(obj=order)
+    form = OrderStatusForm()
 
     if form.validate_on_submit():
+        # Lock the row so concurrent admin edits can't overwrite each other
+        order = (Order.query.options(lazyload(Order.items))
+                 .filter_by(id=order_id)
+                 .with_for_update()
+                 .first_or_404())
         order.status          = form.status.data
         order.tracking_number = form.tracking_number.data
         order.admin_notes     = form.admin_notes.data
         db.session.commit()
+        _invalidate_pending_count()
         flash("Order updated.", "success")
         return redirect(url_for("admin_bp.order_detail", order_id=order.id))
 
+    order = Order.query.get_or_404(order_id)
+    if request.method == "GET":
+        form = OrderStatusForm(obj=order)
+
     return render_template("admin/order_detail.html",
                            order=order, form=form, statuses=ORDER_STATUSES)
 
@@ -369,6 +580,7 @@ def order_delete(order_id):
     num   = order.order_number
     db.session.delete(order)
     db.session.commit()
+    _invalidate_pending_count()
     flash(f"Order {num} deleted.", "warning")
     return redirect(url_for("admin_bp.orders"))
 
@@ -377,6 +589,32 @@ def order_delete(order_id):
 # Site Settings
 # ---------------------------------------------------------------------------
 
+def _upload_site_image(file_storage, key, max_size, cfg, updates):
+    """
+    Store an uploaded logo / background image under settings `key`.
+    Processed inline it is added to `updates`; when queued for background
+    resizing, the worker switches the setting once the file is ready.  A
+    rejected upload is flashed as an error and leaves the setting alone.
+    """
+    if not file_storage or not file_storage.filename:
+        return
+
+    old_path = cfg.get(key)
+
+    def on_saved(path):
+        SiteSettings.set(key, path)
+        delete_image(old_path)
+
+    path = save_image_async(file_storage, "site", max_size, max_size, on_saved)
+    if path is IMAGE_QUEUED:
+        flash("Image uploaded — it will appear once processing finishes.", "info")
+    elif path:
+        updates[key] = path
+        schedule_delete_image(old_path)
+    else:
+        flash(f'"{file_storage.filename}" could not be used as an image.', "danger")
+
+
 @admin_bp.route("/settings", methods=["GET", "POST"])
 @login_required
 def settings():
@@ -402,30 +640,20 @@ def settings():
             "announcement_text", "contact_email", "contact_phone",
             "instagram_url", "facebook_url",
         ]
-        for field_name in text_fields:
-            SiteSettings.set(field_name, getattr(form, field_name).data or "")
-
-        SiteSettings.set("delivery_cost",
-                         str(form.delivery_cost.data or "0"))
-        SiteSettings.set("free_delivery_threshold",
-                         str(form.free_delivery_threshold.data or "0"))
-
-        # Logo upload
-        if form.logo_image.data and form.logo_image.data.filename:
-            old = SiteSettings.get("logo_image")
-            delete_image(old)
-            path = save_image(form.logo_image.data, "site", 400, 400)
-            if path:
-                SiteSettings.set("logo_image", path)
-
-        # Background image upload
-        if form.background_image.data and form.background_image.data.filename:
-            old = SiteSettings.get("background_image")
-            delete_image(old)
-            path = save_image(form.background_image.data, "site", 2000, 2000)
-            if path:
-                SiteSettings.set("background_image", path)
-
+        updates = {fn: getattr(form, fn).data or "" for fn in text_fields}
+        updates["delivery_cost"] = str(form.delivery_cost.data or "0")
+        updates["free_delivery_threshold"] = str(form.free_delivery_threshold.data or "0")
+
+        # Logo / background uploads — resized off the request where possible
+        _upload_site_image(form.logo_image.data, "logo_image", 400, cfg, updates)
+        _upload_site_image(form.background_image.data, "background_image",
+                           2000, cfg, updates)
+
+        # One upsert + one commit for every changed key
+        SiteSettings.set_many(updates)
+        SiteSettings.bump_version()
+        db.session.commit()
+        invalidate_settings_cache()
         flash("Site settings saved.", "success")
         return redirect(url_for("admin_bp.settings"))
 
@@ -5,14 +5,20 @@ All customer-facing routes: homepage, product detail, cart, checkout,
 order confirmation.
 """
 
-from decimal import Decimal
+from sqlalchemy import case, func, insert, literal, select, update
 from flask import Blueprint, render_template, redirect, url_for, \
-    request, flash, abort, session
-from app.models import Product, Category, Order, OrderItem, SiteSettings
+    request, flash, abort, session, jsonify
+from app.models import (
+    Product, Category, Order, OrderItem, SiteSettings, product_list_options,
+    COUNTER_TOTAL_ORDERS, COUNTER_PENDING_ORDERS, bump_counter,
+)
 from app.forms import CheckoutForm
 from app.utils import (
-    get_cart, add_to_cart, update_cart, remove_from_cart,
-    clear_cart, cart_totals, get_settings,
+    get_cart, add_to_cart, update_cart, remove_from_cart, clear_cart,
+    cart_lines, cart_totals, cart_count, cart_subtotal_cents,
+    get_settings, fts_match_ids, delivery_rule, from_cents,
+    keyset_paginate, homepage_product_lists, invalidate_product_lists,
+    category_id_for,
 )
 from app import db
 
@@ -25,10 +31,8 @@ main_bp = Blueprint("main_bp", __name__)
 
 @main_bp.context_processor
 def inject_globals():
-    settings = get_settings()
-    cart = get_cart()
-    cart_count = sum(v["qty"] for v in cart.values())
-    return {"settings": settings, "cart_count": cart_count}
+    # Templates get `settings` from here; views need not pass it again
+    return {"settings": get_settings(), "cart_count": cart_count()}
 
 
 # ---------------------------------------------------------------------------
@@ -37,45 +41,38 @@ def inject_globals():
 
 @main_bp.route("/")
 def index():
-    settings   = get_settings()
     categories = Category.query.order_by(Category.sort_order).all()
 
-    # Featured products
-    featured = (Product.query
-                .filter_by(is_active=True, is_featured=True)
-                .order_by(Product.created_at.desc())
-                .limit(8).all())
-
-    # Current deals
-    deals = (Product.query
-             .filter_by(is_active=True, is_deal=True)
-             .order_by(Product.created_at.desc())
-             .limit(8).all())
+    # Featured products and current deals — shared in-process, see utils
+    featured, deals = homepage_product_lists()
 
     # All active products for the grid (paginated)
-    page = request.args.get("page", 1, type=int)
     category_slug = request.args.get("category", "")
     search_query  = request.args.get("q", "").strip()
 
-    products_query = Product.query.filter_by(is_active=True)
+    products_query = (Product.query
+                      .options(*product_list_options())
+                      .filter_by(is_active=True))
 
     if category_slug:
-        cat = Category.query.filter_by(slug=category_slug).first()
-        if cat:
-            products_query = products_query.filter_by(category_id=cat.id)
+        cat_id = category_id_for(category_slug)
+        if cat_id:
+            products_query = products_query.filter_by(category_id=cat_id)
 
     if search_query:
-        products_query = products_query.filter(
-            Product.name.ilike(f"%{search_query}%")
-        )
+        ids = fts_match_ids("products", search_query)
+        if ids is None:
+            products_query = products_query.filter(
+                Product.name.ilike(f"%{search_query}%")
+            )
+        else:
+            products_query = products_query.filter(Product.id.in_(ids))
 
-    products = products_query.order_by(Product.created_at.desc()).paginate(
-        page=page, per_page=12, error_out=False
-    )
+    # Keyset paging: one LIMIT 13 query per page, no COUNT(*) / OFFSET scan
+    products = keyset_paginate(products_query, Product, per_page=12)
 
     return render_template(
         "index.html",
-        settings=settings,
         categories=categories,
         featured=featured,
         deals=deals,
@@ -92,12 +89,12 @@ def index():
 @main_bp.route("/product/<slug>")
 def product_detail(slug):
     product  = Product.query.filter_by(slug=slug, is_active=True).first_or_404()
-    settings = get_settings()
 
     # Related products — same category, exclude current
     related = []
     if product.category_id:
         related = (Product.query
+                   .options(*product_list_options())
                    .filter_by(category_id=product.category_id, is_active=True)
                    .filter(Product.id != product.id)
                    .limit(4).all())
@@ -106,7 +103,6 @@ def product_detail(slug):
         "product_detail.html",
         product=product,
         related=related,
-        settings=settings,
     )
 
 
@@ -116,39 +112,40 @@ def product_detail(slug):
 
 @main_bp.route("/cart")
 def cart():
-    settings = get_settings()
-    cart_data = get_cart()
-    totals = cart_totals(
-        settings.get("delivery_cost", "5.00"),
-        settings.get("free_delivery_threshold", "50.00"),
-    )
-    return render_template("cart.html", cart=cart_data,
-                           totals=totals, settings=settings)
+    lines  = cart_lines()
+    totals = cart_totals()
+    return render_template("cart.html", lines=lines, totals=totals)
+
+
+def _cart_response(message: str, category: str, fallback: str):
+    """JSON for fetch() callers; flash + redirect for plain form posts."""
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({"message": message, "cart_count": cart_count(),
+                        "subtotal_cents": cart_subtotal_cents()})
+    flash(message, category)
+    return redirect(fallback)
 
 
 @main_bp.route("/cart/add/<int:product_id>", methods=["POST"])
 def cart_add(product_id):
     product = Product.query.get_or_404(product_id)
     qty = int(request.form.get("qty", 1))
-    add_to_cart(product.id, product.name,
-                product.active_price, product.image or "", qty)
-    flash(f'"{product.name}" added to your cart.', "success")
-    return redirect(request.referrer or url_for("main_bp.index"))
+    add_to_cart(product.id, product.active_price_cents, qty)
+    return _cart_response(f'"{product.name}" added to your cart.', "success",
+                          request.referrer or url_for("main_bp.index"))
 
 
 @main_bp.route("/cart/update/<int:product_id>", methods=["POST"])
 def cart_update(product_id):
     qty = int(request.form.get("qty", 0))
     update_cart(product_id, qty)
-    flash("Cart updated.", "info")
-    return redirect(url_for("main_bp.cart"))
+    return _cart_response("Cart updated.", "info", url_for("main_bp.cart"))
 
 
 @main_bp.route("/cart/remove/<int:product_id>", methods=["POST"])
 def cart_remove(product_id):
     remove_from_cart(product_id)
-    flash("Item removed from cart.", "info")
-    return redirect(url_for("main_bp.cart"))
+    return _cart_response("Item removed from cart.", "info", url_for("main_bp.cart"))
 
 
 # ---------------------------------------------------------------------------
@@ -157,67 +154,99 @@ def cart_remove(product_id):
 
 @main_bp.route("/checkout", methods=["GET", "POST"])
 def checkout():
-    settings  = get_settings()
-    cart_data = get_cart()
+    lines    = cart_lines()   # also drops products deleted since adding
 
-    if not cart_data:
+    if not lines:
         flash("Your cart is empty.", "warning")
         return redirect(url_for("main_bp.index"))
 
-    totals = cart_totals(
-        settings.get("delivery_cost", "5.00"),
-        settings.get("free_delivery_threshold", "50.00"),
-    )
-    form = CheckoutForm()
+    totals = cart_totals()
+    if request.method != "POST":
+        # GET only renders: skip binding and processing request form data
+        form = CheckoutForm(formdata=None)
+        return render_template("checkout.html", form=form, lines=lines, totals=totals)
 
+    form = CheckoutForm()
     if form.validate_on_submit():
-        # Build order
-        order = Order(
-            order_number     = Order.generate_order_number(),
-            customer_name    = form.customer_name.data,
-            customer_email   = form.customer_email.data,
-            customer_phone   = form.customer_phone.data,
-            shipping_address = form.shipping_address.data,
-            city             = form.city.data,
-            postal_code      = form.postal_code.data,
-            country          = form.country.data,
-            notes            = form.notes.data,
-            subtotal         = totals["subtotal"],
-            delivery_cost    = totals["delivery"],
-            total_amount     = totals["total"],
-        )
-        db.session.add(order)
-        db.session.flush()  # get order.id before adding items
-
-        for pid_str, item in cart_data.items():
-            product = db.session.get(Product, int(pid_str))
-            oi = OrderItem(
-                order_id     = order.id,
-                product_id   = product.id if product else None,
-                product_name = item["name"],
-                product_sku  = product.sku if product else None,
-                unit_price   = Decimal(item["price"]),
-                quantity     = item["qty"],
-                line_total   = Decimal(item["price"]) * item["qty"],
+        # Build order with one INSERT ... RETURNING (no unit of work);
+        # money columns are filled in by SQL below
+        order_id, order_number = db.session.execute(
+            insert(Order)
+            .values(
+                customer_name    = form.customer_name.data,
+                customer_email   = form.customer_email.data,
+                customer_phone   = form.customer_phone.data,
+                shipping_address = form.shipping_address.data,
+                city             = form.city.data,
+                postal_code      = form.postal_code.data,
+                country          = form.country.data,
+                notes            = form.notes.data,
+            )
+            .returning(Order.id, Order.order_number)
+        ).one()
+        # Statement-level inserts bypass the mapper events that keep counters
+        bump_counter(db.session.connection(), COUNTER_TOTAL_ORDERS, 1)
+        bump_counter(db.session.connection(), COUNTER_PENDING_ORDERS, 1)
+
+        # Charge what the cart (and this page) showed: the cents stored when
+        # each item was added, not whatever the product costs now
+        cart_data = get_cart()
+        cart_rows = list(zip(cart_data["pids"], cart_data["qtys"],
+                             cart_data["prices"]))
+        qty   = case({pid: q for pid, q, _ in cart_rows}, value=Product.id)
+        price = case({pid: from_cents(c) for pid, _, c in cart_rows},
+                     value=Product.id)
+        line_total = case({pid: from_cents(c * q) for pid, q, c in cart_rows},
+                          value=Product.id)
+        in_cart = Product.id.in_(cart_data["pids"])
+
+        # Every line item in one INSERT ... SELECT (names / SKUs from products)
+        db.session.execute(
+            insert(OrderItem).from_select(
+                ["order_id", "product_id", "product_name", "product_sku",
+                 "unit_price", "quantity", "line_total"],
+                select(literal(order_id), Product.id, Product.name, Product.sku,
+                       price, qty, line_total).where(in_cart),
             )
-            db.session.add(oi)
+        )
+
+        # Totals summed server-side from the rows just written
+        subtotal = (select(func.coalesce(func.sum(OrderItem.line_total), 0))
+                    .where(OrderItem.order_id == order_id)
+                    .scalar_subquery())
+        delivery_cents, threshold_cents = delivery_rule()
+        delivery_cost = literal(from_cents(delivery_cents))
+        delivery = (case((subtotal >= from_cents(threshold_cents), 0),
+                         else_=delivery_cost)
+                    if threshold_cents > 0 else delivery_cost)
+        db.session.execute(
+            update(Order)
+            .where(Order.id == order_id)
+            .values(subtotal=subtotal, delivery_cost=delivery,
+                    total_amount=subtotal + delivery)
+            .execution_options(synchronize_session=False)
+        )
 
-            # Decrement stock if tracked
-            if product and product.stock > 0:
-                product.stock = max(0, product.stock - item["qty"])
+        # ... and one UPDATE for all tracked stock (stock 0 = untracked)
+        db.session.execute(
+            update(Product)
+            .where(in_cart, Product.stock > 0)
+            .values(stock=case((Product.stock > qty, Product.stock - qty), else_=0))
+            .execution_options(synchronize_session=False)
+        )
 
         db.session.commit()
         clear_cart()
+        invalidate_product_lists()   # stock shown on the cached cards
 
         return redirect(url_for("main_bp.order_confirmation",
-                                order_number=order.order_number))
+                                order_number=order_number))
 
     return render_template(
         "checkout.html",
         form=form,
-        cart=cart_data,
+        lines=lines,
         totals=totals,
-        settings=settings,
     )
 
 
@@ -227,7 +256,5 @@ def checkout():
 
 @main_bp.route("/order-confirmation/<order_number>")
 def order_confirmation(order_number):
-    order    = Order.query.filter_by(order_number=order_number).first_or_404()
-    settings = get_settings()
-    return render_template("order_confirmation.html",
-                           order=order, settings=settings)
+    order = Order.query.filter_by(order_number=order_number).first_or_404()
+    return render_template("order_confirmation.html", order=order)
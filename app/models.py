@@ -11,13 +11,38 @@ Models
 - Order          : Customer orders
 - OrderItem      : Individual line-items within an order
 - SiteSettings   : Key-value store for all site-wide configuration
+
+Denormalised counters (active products, orders, pending orders) are kept
+in SiteSettings rows and maintained by mapper events at the bottom.
 """
 
-from datetime import datetime, timezone
+import secrets
+from datetime import date, datetime, timezone
+from functools import cached_property
+from sqlalchemy import (
+    Integer, Text, cast, event, func, inspect, literal, select, union_all,
+)
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import defer, selectinload
 from app import db, login_manager
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 
+# Argon2 (native, SIMD-accelerated) when installed; Werkzeug PBKDF2 otherwise
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import InvalidHashError, VerificationError
+except ImportError:
+    _argon2 = None
+else:
+    _argon2 = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=2)
+
+
+def _utcnow() -> datetime:
+    # Python-side, not func.now(): SQLite's CURRENT_TIMESTAMP has no
+    # fractional seconds, which breaks (created_at, id) keyset cursors
+    return datetime.now(timezone.utc)
+
 
 # ---------------------------------------------------------------------------
 # Admin user (authentication)
@@ -32,14 +57,32 @@ class Admin(UserMixin, db.Model):
     email        = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
     is_active    = db.Column(db.Boolean, default=True, nullable=False)
-    created_at   = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at   = db.Column(db.DateTime, default=_utcnow)
     last_login   = db.Column(db.DateTime, nullable=True)
 
     def set_password(self, password: str) -> None:
-        self.password_hash = generate_password_hash(password)
+        if _argon2 is not None:
+            self.password_hash = _argon2.hash(password)
+        else:
+            self.password_hash = generate_password_hash(password)
 
     def check_password(self, password: str) -> bool:
-        return check_password_hash(self.password_hash, password)
+        if not self.password_hash.startswith("$argon2"):
+            return check_password_hash(self.password_hash, password)
+        if _argon2 is None:
+            return False
+        try:
+            return _argon2.verify(self.password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+
+    def needs_rehash(self) -> bool:
+        """True for legacy PBKDF2 hashes or outdated Argon2 parameters."""
+        if _argon2 is None:
+            return False
+        if not self.password_hash.startswith("$argon2"):
+            return True
+        return _argon2.check_needs_rehash(self.password_hash)
 
     def __repr__(self):
         return f"<Admin {self.username}>"
@@ -64,7 +107,7 @@ class Category(db.Model):
     sort_order = db.Column(db.Integer, default=0)
 
     products = db.relationship("Product", back_populates="category",
-                               lazy="dynamic", cascade="all, delete-orphan")
+                               lazy="select", cascade="all, delete-orphan")
 
     def __repr__(self):
         return f"<Category {self.name}>"
@@ -94,6 +137,16 @@ class Product(db.Model):
                         the main description — allows unlimited extra sections.
     """
     __tablename__ = "products"
+    __table_args__ = (
+        db.Index("ix_product_active_stock", "is_active", "stock"),
+        # Storefront listings: filtered by flags, newest first
+        db.Index("ix_products_active_featured_created",
+                 "is_active", "is_featured", "created_at"),
+        db.Index("ix_products_active_deal_created",
+                 "is_active", "is_deal", "created_at"),
+        db.Index("ix_products_active_category_created",
+                 "is_active", "category_id", "created_at"),
+    )
 
     id                = db.Column(db.Integer, primary_key=True)
     name              = db.Column(db.String(200), nullable=False)
@@ -108,7 +161,8 @@ class Product(db.Model):
 
     # Content
     description       = db.Column(db.Text, nullable=False, default="")
-    extra_content     = db.Column(db.Text, nullable=True)  # JSON string
+    extra_content     = db.Column(db.JSON().with_variant(JSONB, "postgresql"),
+                                  nullable=True)  # list of blocks, parsed
 
     # Media
     image             = db.Column(db.String(300), nullable=True)
@@ -121,17 +175,18 @@ class Product(db.Model):
     stock             = db.Column(db.Integer, default=0, nullable=False)
 
     # Timestamps
-    created_at        = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at        = db.Column(db.DateTime, default=_utcnow)
     updated_at        = db.Column(db.DateTime,
-                                  default=lambda: datetime.now(timezone.utc),
-                                  onupdate=lambda: datetime.now(timezone.utc))
+                                  default=_utcnow,
+                                  onupdate=_utcnow)
 
     # Relationships
     category          = db.relationship("Category", back_populates="products")
     order_items       = db.relationship("OrderItem", back_populates="product",
                                         lazy="dynamic")
 
-    @property
+    # Prices are read several times per card/page; compute once per instance
+    @cached_property
     def active_price(self):
         """Returns the best (lowest) price currently applicable."""
         if self.deal_price:
@@ -140,7 +195,12 @@ class Product(db.Model):
             return self.discounted_price
         return self.original_price
 
-    @property
+    @cached_property
+    def active_price_cents(self):
+        """active_price as integer cents, for cart and checkout arithmetic."""
+        return int((self.active_price or 0) * 100)
+
+    @cached_property
     def discount_percent(self):
         """Percentage saved vs original price (rounded int)."""
         if self.original_price and self.active_price < self.original_price:
@@ -148,20 +208,24 @@ class Product(db.Model):
             return int(saving * 100)
         return 0
 
-    def get_extra_content(self):
-        """Return extra_content parsed from JSON, or empty list."""
-        import json
-        if self.extra_content:
-            try:
-                return json.loads(self.extra_content)
-            except (ValueError, TypeError):
-                return []
-        return []
-
     def __repr__(self):
         return f"<Product {self.name}>"
 
 
+def product_list_options() -> tuple:
+    """
+    Loader options for product lists and cards: the category name is shown,
+    the long text columns are not.  Built per call — creating them at import
+    time would configure the mappers before OrderItem is defined.
+    """
+    return (
+        selectinload(Product.category),
+        defer(Product.description),
+        defer(Product.extra_content),
+        defer(Product.gallery),
+    )
+
+
 # ---------------------------------------------------------------------------
 # Order
 # ---------------------------------------------------------------------------
@@ -177,12 +241,22 @@ ORDER_STATUSES = [
 ]
 
 
+def _new_order_number() -> str:
+    """ORD-YYYYMMDD-XXXXXX — 16M random suffixes per day, so no retry loop."""
+    return f"ORD-{date.today():%Y%m%d}-{secrets.token_hex(3).upper()}"
+
+
 class Order(db.Model):
     """A customer order."""
     __tablename__ = "orders"
+    __table_args__ = (
+        db.Index("ix_order_status_created", "status", "created_at"),
+        db.Index("ix_order_created_id", "created_at", "id"),
+    )
 
     id               = db.Column(db.Integer, primary_key=True)
-    order_number     = db.Column(db.String(20), unique=True, nullable=False, index=True)
+    order_number     = db.Column(db.String(20), unique=True, nullable=False, index=True,
+                                 default=_new_order_number)
     status           = db.Column(db.String(30), default="pending", nullable=False)
 
     # Customer details
@@ -206,23 +280,14 @@ class Order(db.Model):
     tracking_number  = db.Column(db.String(100), nullable=True)
 
     # Timestamps
-    created_at       = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at       = db.Column(db.DateTime, default=_utcnow)
     updated_at       = db.Column(db.DateTime,
-                                 default=lambda: datetime.now(timezone.utc),
-                                 onupdate=lambda: datetime.now(timezone.utc))
+                                 default=_utcnow,
+                                 onupdate=_utcnow)
 
     items            = db.relationship("OrderItem", back_populates="order",
                                        cascade="all, delete-orphan", lazy="joined")
 
-    @staticmethod
-    def generate_order_number():
-        """Generate a unique order number like ORD-20240115-0042."""
-        from datetime import date
-        import random
-        today = date.today().strftime("%Y%m%d")
-        rand  = random.randint(1000, 9999)
-        return f"ORD-{today}-{rand}"
-
     def __repr__(self):
         return f"<Order {self.order_number}>"
 
@@ -253,6 +318,11 @@ class OrderItem(db.Model):
 # Site Settings (key → value store)
 # ---------------------------------------------------------------------------
 
+# Integer row bumped on every settings write; caches compare it to decide
+# whether their copy is still current
+SETTINGS_VERSION_KEY = "settings:version"
+
+
 class SiteSettings(db.Model):
     """
     Flexible key-value store for all site-wide configuration.
@@ -266,17 +336,178 @@ class SiteSettings(db.Model):
 
     @classmethod
     def get(cls, key: str, default: str = "") -> str:
-        row = cls.query.filter_by(key=key).first()
-        return row.value if row else default
+        value = db.session.execute(
+            select(cls.value).where(cls.key == key)
+        ).scalar_one_or_none()
+        return default if value is None else value
+
+    @classmethod
+    def as_dict(cls) -> dict:
+        """All settings in one query — prefer this over repeated get() calls."""
+        # Plain (key, value) tuples: no ORM instances or identity-map work.
+        # The counter rows are bookkeeping, not settings for templates.
+        return dict(db.session.execute(
+            select(cls.key, cls.value).where(cls.key.not_in(COUNTER_KEYS))
+        ).all())
 
     @classmethod
     def set(cls, key: str, value: str) -> None:
+        from app.utils import invalidate_settings_cache
         row = cls.query.filter_by(key=key).first()
         if row:
             row.value = value
         else:
             db.session.add(cls(key=key, value=value))
+        cls.bump_version()
         db.session.commit()
+        invalidate_settings_cache()
+
+    @classmethod
+    def set_many(cls, mapping: dict) -> None:
+        """
+        Upsert several keys in one statement (SQLite 3.24+ / PostgreSQL
+        ON CONFLICT).  The caller is responsible for bump_version() when
+        these are user-visible settings, committing, and then calling
+        invalidate_settings_cache().
+        """
+        if not mapping:
+            return
+        rows = [{"key": k, "value": v} for k, v in mapping.items()]
+        dialect = db.session.get_bind().dialect.name
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        elif dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            for row in rows:
+                existing = cls.query.filter_by(key=row["key"]).first()
+                if existing:
+                    existing.value = row["value"]
+                else:
+                    db.session.add(cls(**row))
+            return
+        stmt = insert(cls).values(rows)
+        stmt = stmt.on_conflict_do_update(index_elements=["key"],
+                                          set_={"value": stmt.excluded.value})
+        db.session.execute(stmt)
+
+    @classmethod
+    def bump_version(cls) -> None:
+        """Mark settings as changed for every worker's cache (see utils)."""
+        bump_counter(db.session.connection(), SETTINGS_VERSION_KEY, 1)
 
     def __repr__(self):
         return f"<SiteSettings {self.key}={self.value[:40]}>"
+
+
+# ---------------------------------------------------------------------------
+# Denormalised counters (kept in SiteSettings, updated on every flush)
+# ---------------------------------------------------------------------------
+
+COUNTER_ACTIVE_PRODUCTS = "counter:active_products"
+COUNTER_TOTAL_ORDERS    = "counter:total_orders"
+COUNTER_PENDING_ORDERS  = "counter:pending_orders"
+COUNTER_KEYS = (COUNTER_ACTIVE_PRODUCTS, COUNTER_TOTAL_ORDERS, COUNTER_PENDING_ORDERS)
+
+
+def get_counters() -> dict:
+    """Return {counter_key: int} for every counter row that exists."""
+    rows = (db.session.query(SiteSettings.key, SiteSettings.value)
+            .filter(SiteSettings.key.in_(COUNTER_KEYS)).all())
+    return {key: int(value) for key, value in rows}
+
+
+def seed_counters() -> dict:
+    """
+    Create any missing counter rows from a live recount and return the
+    counters.  Counting and writing are one INSERT ... SELECT ... ON
+    CONFLICT DO NOTHING, so the seed is never older than the transaction
+    that writes it, and rows another worker seeded first are kept.
+    """
+    recount = union_all(*(
+        select(literal(key), cast(count.scalar_subquery(), Text))
+        for key, count in (
+            (COUNTER_ACTIVE_PRODUCTS,
+             select(func.count(Product.id)).where(Product.is_active == True)),
+            (COUNTER_TOTAL_ORDERS, select(func.count(Order.id))),
+            (COUNTER_PENDING_ORDERS,
+             select(func.count(Order.id)).where(Order.status == "pending")),
+        )
+    ))
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        # No portable upsert: serve the live counts without storing them
+        return {key: int(value) for key, value in db.session.execute(recount)}
+    db.session.execute(
+        insert(SiteSettings.__table__)
+        .from_select(["key", "value"], recount)
+        .on_conflict_do_nothing(index_elements=["key"])
+    )
+    return get_counters()
+
+
+def bump_counter(connection, key: str, delta: int) -> None:
+    """
+    Adjust a counter in place with a single UPDATE.  A missing row is left
+    missing — readers then recount and re-seed it.
+    """
+    if not delta:
+        return
+    table = SiteSettings.__table__
+    connection.execute(
+        table.update()
+        .where(table.c.key == key)
+        .values(value=cast(cast(table.c.value, Integer) + delta, Text))
+    )
+
+
+def _changed_delta(target, attr: str, value) -> int:
+    """+1 / -1 / 0 for whether `attr == value` became true / false / stayed."""
+    history = inspect(target).attrs[attr].history
+    if not history.has_changes():
+        return 0
+    was = value in history.deleted
+    now = getattr(target, attr) == value
+    return int(now) - int(was)
+
+
+@event.listens_for(Product, "after_insert")
+def _product_inserted(mapper, connection, target):
+    if target.is_active:
+        bump_counter(connection, COUNTER_ACTIVE_PRODUCTS, 1)
+
+
+@event.listens_for(Product, "after_update")
+def _product_updated(mapper, connection, target):
+    bump_counter(connection, COUNTER_ACTIVE_PRODUCTS,
+                 _changed_delta(target, "is_active", True))
+
+
+@event.listens_for(Product, "after_delete")
+def _product_deleted(mapper, connection, target):
+    if target.is_active:
+        bump_counter(connection, COUNTER_ACTIVE_PRODUCTS, -1)
+
+
+@event.listens_for(Order, "after_insert")
+def _order_inserted(mapper, connection, target):
+    bump_counter(connection, COUNTER_TOTAL_ORDERS, 1)
+    if target.status == "pending":
+        bump_counter(connection, COUNTER_PENDING_ORDERS, 1)
+
+
+@event.listens_for(Order, "after_update")
+def _order_updated(mapper, connection, target):
+    bump_counter(connection, COUNTER_PENDING_ORDERS,
+                 _changed_delta(target, "status", "pending"))
+
+
+@event.listens_for(Order, "after_delete")
+def _order_deleted(mapper, connection, target):
+    bump_counter(connection, COUNTER_TOTAL_ORDERS, -1)
+    if target.status == "pending":
+        bump_counter(connection, COUNTER_PENDING_ORDERS, -1)
@@ -0,0 +1,65 @@
+"""
+Jewelry Store — Session Serialisation
+======================================
+Signed-cookie sessions encoded with msgpack instead of Flask's tagged JSON.
+The cart and login state are read on nearly every request, so the cheaper
+C-level (de)serialiser and smaller cookie pay off on every page.
+"""
+
+from decimal import Decimal
+
+import msgpack
+from flask.sessions import SecureCookieSessionInterface
+
+# msgpack extension type code for Decimal (sent as its string form)
+_EXT_DECIMAL = 1
+
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        return msgpack.ExtType(_EXT_DECIMAL, str(obj).encode())
+    raise TypeError(f"Cannot serialise {type(obj).__name__} into the session")
+
+
+def _ext_hook(code, data):
+    if code == _EXT_DECIMAL:
+        return Decimal(data.decode())
+    return msgpack.ExtType(code, data)
+
+
+class MsgpackSerializer:
+    """dumps/loads pair in the shape itsdangerous expects (bytes payload)."""
+
+    def dumps(self, obj) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True, default=_default)
+
+    def loads(self, data: bytes):
+        return msgpack.unpackb(data, raw=False, ext_hook=_ext_hook)
+
+
+class _AsciiTokens:
+    """
+    With a bytes serializer itsdangerous returns bytes tokens, which
+    response.set_cookie() rejects.  Hand Flask the ASCII text instead.
+    """
+
+    def __init__(self, signer):
+        self._signer = signer
+
+    def dumps(self, obj) -> str:
+        return self._signer.dumps(obj).decode("ascii")
+
+    def loads(self, token, **kwargs):
+        return self._signer.loads(token, **kwargs)
+
+
+class MsgpackSessionInterface(SecureCookieSessionInterface):
+    # A distinct salt makes cookies written by the JSON serialiser fail the
+    # signature check, so they start a fresh session instead of erroring
+    salt = "cookie-session-msgpack"
+    serializer = MsgpackSerializer()
+
+    def get_signing_serializer(self, app):
+        signer = super().get_signing_serializer(app)
+        return None if signer is None else _AsciiTokens(signer)
+
@@ -1,6 +1,7 @@
 /**
  * Jewelry Store — Public JavaScript
- * Handles: qty stepper, scroll-triggered effects, mobile nav tweaks.
+ * Handles: qty stepper, scroll-triggered effects, mobile nav tweaks,
+ * add-to-cart without a page reload.
  */
 
 document.addEventListener('DOMContentLoaded', () => {
@@ -35,14 +36,45 @@ document.addEventListener('DOMContentLoaded', () => {
     });
   });
 
-  /* ── Product card "Add to Cart" loading state ────────────────────── */
-  document.querySelectorAll('.product-cta form').forEach(form => {
-    form.addEventListener('submit', function () {
+  /* ── "Add to Cart" via fetch: update the badge, no page reload ───── */
+  const setCartBadge = count => {
+    const cartBtn = document.querySelector('.btn-cart');
+    if (!cartBtn) return;
+    let badge = cartBtn.querySelector('.cart-badge');
+    if (!badge) {
+      badge = document.createElement('span');
+      badge.className = 'cart-badge';
+      cartBtn.appendChild(badge);
+    }
+    badge.textContent = count;
+    badge.hidden = count <= 0;
+  };
+
+  document.querySelectorAll('form.js-cart-add').forEach(form => {
+    form.addEventListener('submit', async function (e) {
+      e.preventDefault();
       const btn = this.querySelector('button[type="submit"]');
+      const label = btn ? btn.innerHTML : '';
       if (btn) {
         btn.disabled = true;
         btn.innerHTML = '<span class="spinner-border spinner-border-sm me-1"></span>Adding…';
       }
+      try {
+        const res = await fetch(this.action, {
+          method: 'POST',
+          body: new FormData(this),
+          headers: { 'Accept': 'application/json' },
+        });
+        if (!res.ok) throw new Error(res.status);
+        const data = await res.json();
+        setCartBadge(data.cart_count);
+        if (btn) btn.innerHTML = '<i class="bi bi-check2 me-1"></i>Added';
+        setTimeout(() => {
+          if (btn) { btn.disabled = false; btn.innerHTML = label; }
+        }, 1500);
+      } catch (err) {
+        this.submit();   // fall back to the regular POST + redirect
+      }
     });
   });
 
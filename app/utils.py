@@ -4,30 +4,46 @@ Jewelry Store — Utility Helpers
 Shared functions used by both blueprints:
   - slugify()         : Convert a name to a URL-safe slug
   - save_image()      : Validate, resize, and save an uploaded image file
+  - save_image_async(): Same, with resizing on the background executor
+  - schedule_delete_image(): Remove an image after the response is sent
   - cart helpers      : Read / write the session-based shopping cart
   - get_settings()    : Fetch all SiteSettings as a plain dict for templates
+  - delivery_rule()   : Delivery cost / free threshold in cents
+  - homepage_product_lists(): Cached featured / deal product cards
+  - category_id_for() : Cached category slug → id lookup
+  - keyset_paginate() : Newest-first "seek" pagination without COUNT(*)
+  - fts_match_ids()   : Full-text lookup against the SQLite FTS5 tables
 """
 
+import base64
 import os
 import re
+import shutil
+import subprocess
+import time
 import uuid
+from datetime import datetime
 from decimal import Decimal
+from functools import lru_cache
 
-from flask import session, current_app
+from flask import session, current_app, request, g, after_this_request
 from PIL import Image
+from sqlalchemy import and_, or_, text
+from sqlalchemy.exc import OperationalError
 
 
 # ---------------------------------------------------------------------------
 # Slug generation
 # ---------------------------------------------------------------------------
 
+# One pass: every run of non-word characters (and underscores) becomes a
+# single "-".  \w rather than [a-z0-9] so non-Latin names keep their letters.
+_SLUG_SEP = re.compile(r"[\W_]+")
+
+
 def slugify(text: str) -> str:
     """Return a URL-safe, lowercase, hyphenated slug from arbitrary text."""
-    text = text.lower().strip()
-    text = re.sub(r"[^\w\s-]", "", text)
-    text = re.sub(r"[\s_]+", "-", text)
-    text = re.sub(r"-+", "-", text)
-    return text
+    return _SLUG_SEP.sub("-", text.lower()).strip("-")
 
 
 # ---------------------------------------------------------------------------
@@ -36,10 +52,118 @@ def slugify(text: str) -> str:
 
 ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png", "webp", "gif", "svg"}
 
+# save_image_async() result when the upload was handed to the executor
+IMAGE_QUEUED = object()
+
+
+def _extract_ext(filename: str) -> str | None:
+    """Lower-cased extension if it is an allowed image type, else None."""
+    _, dot, ext = filename.rpartition(".")
+    ext = ext.lower()
+    return ext if dot and ext in ALLOWED_EXTENSIONS else None
+
+
+# Upload directories already created by this process; each is checked once
+_ENSURED_DIRS: set[str] = set()
+
+
+def _ensure_dir(path: str) -> None:
+    if path not in _ENSURED_DIRS:
+        os.makedirs(path, exist_ok=True)
+        _ENSURED_DIRS.add(path)
+
+
+def _new_upload_path(subfolder: str, ext: str) -> tuple[str, str]:
+    """Return (absolute path, path relative to /static) for a new upload."""
+    # 22 url-safe base64 chars for the 16 random bytes, vs 32 hex
+    token = base64.urlsafe_b64encode(uuid.uuid4().bytes).rstrip(b"=").decode("ascii")
+    filename = f"{token}.{ext}"
+    # Shard by the first two characters so no directory grows unbounded;
+    # older flat uploads keep working since their stored paths are unchanged
+    shard = token[:2]
+    upload_dir = os.path.join(current_app.config["UPLOAD_FOLDER"], subfolder, shard)
+    _ensure_dir(upload_dir)
+    return (os.path.join(upload_dir, filename),
+            f"uploads/{subfolder}/{shard}/{filename}")
+
+
+def _resize_and_save(src, ext: str, filepath: str,
+                     max_width: int, max_height: int) -> None:
+    img = Image.open(src)
+    # JPEG only (no-op otherwise): let libjpeg decode at 1/2, 1/4 or 1/8
+    # scale when that still covers the target box
+    img.draft("RGB", (max_width, max_height))
+    img = img.convert("RGBA") if ext == "png" else img.convert("RGB")
+    img.thumbnail((max_width, max_height), Image.LANCZOS)
+    # Pillow's JPEG optimize=True can leave artifacts; progressive JPEGs are
+    # comparably small and jpegoptim does the Huffman pass afterwards
+    if ext in {"jpg", "jpeg"}:
+        img.save(filepath, quality=88, progressive=True)
+    else:
+        img.save(filepath, optimize=True, quality=88)
+
+
+# Lossless second pass with dedicated optimisers, when installed.  They pick
+# better Huffman tables / zlib strategies than Pillow's single-pass encoder.
+_OPTIMIZERS = {
+    "jpg":  ["jpegoptim", "--strip-all", "--all-progressive", "--quiet"],
+    "jpeg": ["jpegoptim", "--strip-all", "--all-progressive", "--quiet"],
+    "png":  ["oxipng", "-o2", "--strip", "safe", "--quiet"],
+}
 
-def _allowed_file(filename: str) -> bool:
-    return "." in filename and \
-           filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def _optimize_file(filepath: str, ext: str) -> None:
+    """Rewrite `filepath` in place with jpegoptim / oxipng, if available."""
+    cmd = _OPTIMIZERS.get(ext)
+    if not cmd or not shutil.which(cmd[0]):
+        return
+    try:
+        subprocess.run(cmd + [filepath], check=False, timeout=60,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.TimeoutExpired):
+        pass
+
+
+def _schedule_optimize(filepath: str, ext: str) -> None:
+    """Run _optimize_file() on the background executor (skipped without one)."""
+    executor = getattr(current_app, "executor", None)
+    if executor is not None and ext in _OPTIMIZERS:
+        executor.submit(_optimize_file, filepath, ext)
+
+
+# Best-effort screen for obviously active SVG markup (scripts, event
+# handlers, embedded documents, entity declarations).  The plain
+# <!DOCTYPE svg PUBLIC ...> that Illustrator / Inkscape export is allowed;
+# a DOCTYPE with an internal subset ("[") is not, as it can declare
+# entities.  A deny-list cannot catch every encoding (e.g. character
+# references inside URLs), so the real protection is the sandboxing CSP
+# that create_app() puts on every uploaded SVG response.
+_SVG_UNSAFE = re.compile(
+    rb"<script|<foreignobject|<iframe|<embed|<object|<!entity"
+    rb"|<!doctype[^>\[]*\[|javascript:|\son[a-z]+\s*=",
+    re.IGNORECASE,
+)
+_SVG_CHUNK   = 64 * 1024
+_SVG_OVERLAP = 1024   # bytes of the previous chunk re-scanned with the next
+
+
+def _copy_svg(src, filepath: str) -> bool:
+    """
+    Stream an SVG to `filepath` in fixed-size chunks, screening each chunk
+    (plus the tail of the previous one) with _SVG_UNSAFE on the way.
+    Returns False, leaving no file behind, if anything matches.
+    """
+    tail = b""
+    with open(filepath, "wb") as out:
+        while chunk := src.read(_SVG_CHUNK):
+            if _SVG_UNSAFE.search(tail + chunk):
+                break
+            out.write(chunk)
+            tail = chunk[-_SVG_OVERLAP:]
+        else:
+            return True
+    os.remove(filepath)
+    return False
 
 
 def save_image(file_storage, subfolder: str = "products",
@@ -50,39 +174,115 @@ def save_image(file_storage, subfolder: str = "products",
     - Generates a UUID filename to prevent collisions.
     - Resizes images larger than max_width × max_height (preserves aspect ratio).
     - Returns the relative path from /static (e.g. 'uploads/products/abc.jpg')
-      or None if file_storage is empty.
+      or None if file_storage is empty or the upload was rejected.
     """
     if not file_storage or not file_storage.filename:
         return None
-    if not _allowed_file(file_storage.filename):
+    ext = _extract_ext(file_storage.filename)
+    if not ext:
         return None
 
-    ext = file_storage.filename.rsplit(".", 1)[1].lower()
-    filename = f"{uuid.uuid4().hex}.{ext}"
-
-    upload_dir = os.path.join(current_app.config["UPLOAD_FOLDER"], subfolder)
-    os.makedirs(upload_dir, exist_ok=True)
-    filepath = os.path.join(upload_dir, filename)
+    filepath, relative_path = _new_upload_path(subfolder, ext)
 
     if ext in {"svg"}:
-        # SVGs are XML — just save without Pillow processing
-        file_storage.save(filepath)
+        # SVGs are XML — stream to disk without Pillow, screening out
+        # obviously active content (see _SVG_UNSAFE)
+        if not _copy_svg(file_storage.stream, filepath):
+            return None
     else:
-        img = Image.open(file_storage.stream)
-        img = img.convert("RGBA") if ext == "png" else img.convert("RGB")
-        img.thumbnail((max_width, max_height), Image.LANCZOS)
-        img.save(filepath, optimize=True, quality=88)
+        _resize_and_save(file_storage.stream, ext, filepath, max_width, max_height)
+        _schedule_optimize(filepath, ext)
+
+    return relative_path
+
+
+def save_image_async(file_storage, subfolder: str, max_width: int,
+                     max_height: int, on_saved) -> str | object | None:
+    """
+    Like save_image(), but only the raw upload is written during the request;
+    resizing runs on `current_app.executor` and `on_saved(relative_path)` is
+    called from the worker, inside an app context, once the file is ready.
+
+    Returns IMAGE_QUEUED when the work was handed to the executor.  Without
+    an executor (Vercel) — or for SVGs, which need no processing — the image
+    is saved inline and its relative path returned directly.  Returns None
+    if file_storage is empty or the upload was rejected.
+    """
+    if not file_storage or not file_storage.filename:
+        return None
+    ext = _extract_ext(file_storage.filename)
+    if not ext:
+        return None
+
+    executor = getattr(current_app, "executor", None)
+    if executor is None or ext == "svg":
+        return save_image(file_storage, subfolder, max_width, max_height)
+
+    pending_dir = os.path.join(current_app.config["UPLOAD_FOLDER"], "pending")
+    _ensure_dir(pending_dir)
+    raw_path = os.path.join(pending_dir, f"{uuid.uuid4().hex}.bin")
+    file_storage.save(raw_path)
+
+    executor.submit(_process_pending_image, current_app._get_current_object(),
+                    raw_path, ext, subfolder, max_width, max_height, on_saved)
+    return IMAGE_QUEUED
+
 
-    return f"uploads/{subfolder}/{filename}"
+def _process_pending_image(app, raw_path, ext, subfolder,
+                           max_width, max_height, on_saved) -> None:
+    with app.app_context():
+        try:
+            filepath, relative_path = _new_upload_path(subfolder, ext)
+            with open(raw_path, "rb") as src:
+                _resize_and_save(src, ext, filepath, max_width, max_height)
+            _optimize_file(filepath, ext)   # already off the request path
+            on_saved(relative_path)
+        except Exception:
+            app.logger.exception(f"Background image processing failed: {raw_path}")
+        finally:
+            if os.path.isfile(raw_path):
+                os.remove(raw_path)
 
 
 def delete_image(relative_path: str) -> None:
     """Delete a previously saved image from disk (silently ignores missing files)."""
     if not relative_path:
         return
-    full_path = os.path.join(current_app.root_path, "static", relative_path)
-    if os.path.isfile(full_path):
-        os.remove(full_path)
+    static_dir = os.path.join(current_app.root_path, "static")
+    full_path = os.path.normpath(os.path.join(static_dir, relative_path))
+    if os.path.commonpath([static_dir, full_path]) != static_dir:
+        return   # never unlink outside static/
+    try:
+        os.unlink(full_path)   # one syscall; no stat() first
+    except (FileNotFoundError, IsADirectoryError):
+        pass
+
+
+def schedule_delete_image(relative_path: str) -> None:
+    """
+    Queue an image for deletion once the current response has been sent,
+    so admin requests don't wait on unlink().  All paths queued during a
+    request are removed together.
+    """
+    if not relative_path:
+        return
+    pending = g.setdefault("_pending_unlinks", [])
+    if not pending:
+        after_this_request(_flush_pending_unlinks)
+    pending.append(relative_path)
+
+
+def _flush_pending_unlinks(response):
+    paths = g.pop("_pending_unlinks", [])
+    app = current_app._get_current_object()
+
+    def unlink_all():
+        with app.app_context():
+            for path in paths:
+                delete_image(path)
+
+    response.call_on_close(unlink_all)
+    return response
 
 
 # ---------------------------------------------------------------------------
@@ -92,72 +292,182 @@ def delete_image(relative_path: str) -> None:
 CART_SESSION_KEY = "cart"
 
 
+def to_cents(value) -> int:
+    """Decimal / str / number → integer cents ("12.50" → 1250)."""
+    return int((Decimal(str(value or "0")) * 100).to_integral_value())
+
+
+@lru_cache(maxsize=32)
+def _setting_cents(value: str) -> int:
+    """to_cents() for setting strings, parsed once per distinct value."""
+    return to_cents(value)
+
+
+def from_cents(cents: int) -> Decimal:
+    """Integer cents → Decimal for display and the Numeric columns."""
+    return Decimal(cents).scaleb(-2)
+
+
+def _empty_cart() -> dict:
+    return {"pids": [], "qtys": [], "prices": []}
+
+
 def get_cart() -> dict:
-    """Return the cart dict from the session, creating it if absent.
-    Structure: { "product_id_str": { "name", "price", "qty", "image" } }
+    """Return the session cart as parallel lists (index i is one line):
+    { "pids": [int], "qtys": [int], "prices": [int cents] }
+    Names and images are not stored — see cart_lines().
     """
-    return session.setdefault(CART_SESSION_KEY, {})
+    cart = session.get(CART_SESSION_KEY)
+    if not cart:
+        return _empty_cart()
+    if "pids" not in cart:
+        # Sessions from the old { "pid": {"name", "price", "qty", "image"} } layout
+        cart = {
+            "pids":   [int(pid) for pid in cart],
+            "qtys":   [v["qty"] for v in cart.values()],
+            "prices": [v["price"] for v in cart.values()],
+        }
+        session[CART_SESSION_KEY] = cart
+    if cart["prices"] and isinstance(cart["prices"][0], str):
+        # Prices used to be stored as Decimal strings
+        cart["prices"] = [to_cents(p) for p in cart["prices"]]
+        session[CART_SESSION_KEY] = cart
+    return cart
+
+
+def _store_cart(cart: dict) -> None:
+    # Only called when the cart really changed: a clean session skips the
+    # serialise → sign → Set-Cookie step entirely
+    session[CART_SESSION_KEY] = cart
+    session.modified = True
 
 
-def add_to_cart(product_id: int, name: str, price: Decimal,
-                image: str, qty: int = 1) -> None:
+def cart_count() -> int:
+    """Number of items in the cart."""
+    return sum(get_cart()["qtys"])
+
+
+def add_to_cart(product_id: int, price_cents: int, qty: int = 1) -> None:
     """Add or increase quantity of a product in the session cart."""
     cart = get_cart()
-    key = str(product_id)
-    if key in cart:
-        cart[key]["qty"] += qty
+    if product_id in cart["pids"]:
+        cart["qtys"][cart["pids"].index(product_id)] += qty
     else:
-        cart[key] = {
-            "name":  name,
-            "price": str(price),   # Decimal → str for JSON serialisation
-            "image": image or "",
-            "qty":   qty,
-        }
-    session.modified = True
+        cart["pids"].append(product_id)
+        cart["qtys"].append(qty)
+        cart["prices"].append(price_cents)
+    _store_cart(cart)
 
 
 def update_cart(product_id: int, qty: int) -> None:
     """Set exact quantity; removes item if qty <= 0."""
-    cart = get_cart()
-    key = str(product_id)
     if qty <= 0:
-        cart.pop(key, None)
-    else:
-        if key in cart:
-            cart[key]["qty"] = qty
-    session.modified = True
+        remove_from_cart(product_id)
+        return
+    cart = get_cart()
+    if product_id not in cart["pids"]:
+        return
+    i = cart["pids"].index(product_id)
+    if cart["qtys"][i] != qty:   # unchanged → no cookie rewrite
+        cart["qtys"][i] = qty
+        _store_cart(cart)
 
 
 def remove_from_cart(product_id: int) -> None:
     """Remove an item from the cart."""
     cart = get_cart()
-    cart.pop(str(product_id), None)
-    session.modified = True
+    if product_id not in cart["pids"]:
+        return
+    i = cart["pids"].index(product_id)
+    for column in cart.values():
+        del column[i]
+    _store_cart(cart)
 
 
 def clear_cart() -> None:
     """Empty the cart."""
-    session[CART_SESSION_KEY] = {}
-    session.modified = True
+    if session.get(CART_SESSION_KEY):
+        _store_cart(_empty_cart())
 
 
-def cart_totals(delivery_cost_str: str, free_threshold_str: str) -> dict:
+def cart_lines() -> list[dict]:
+    """
+    Cart lines for display, with names and images fetched in one query.
+    Products deleted since they were added are dropped from the cart.
+    """
+    from app import db
+    from app.models import Product
+
+    cart = get_cart()
+    if not cart["pids"]:
+        return []
+    info = {
+        pid: (name, image) for pid, name, image in
+        db.session.query(Product.id, Product.name, Product.image)
+                  .filter(Product.id.in_(cart["pids"])).all()
+    }
+
+    lines = []
+    for pid, qty, price in zip(list(cart["pids"]), list(cart["qtys"]), list(cart["prices"])):
+        if pid not in info:
+            remove_from_cart(pid)
+            continue
+        name, image = info[pid]
+        lines.append({"pid": pid, "name": name, "image": image or "",
+                      "price": from_cents(price), "qty": qty})
+    return lines
+
+
+def cart_subtotal_cents() -> int:
+    """Cart subtotal in integer cents."""
+    cart = get_cart()
+    return sum(p * q for p, q in zip(cart["prices"], cart["qtys"]))
+
+
+def _cents_str(cents: int) -> str:
+    """1250 → "12.50" with integer maths only."""
+    return f"{cents // 100}.{cents % 100:02d}"
+
+
+def delivery_rule() -> tuple[int, int]:
+    """
+    (delivery_cents, free_threshold_cents) from the cached settings.
+    Parsed once per distinct value and refreshed whenever the settings
+    cache is, so admin changes apply without a restart.
+    """
+    settings = get_settings()
+    return (_setting_cents(settings.get("delivery_cost", "5.00")),
+            _setting_cents(settings.get("free_delivery_threshold", "50.00")))
+
+
+def cart_totals() -> dict:
     """
     Compute subtotal, delivery, and grand total for the current cart.
-    Returns a dict with: subtotal, delivery, total, item_count.
+    Returns a dict with: subtotal, delivery, total, item_count, and
+    subtotal_str / delivery_str / total_str ("12.50") for display, plus
+    free_delivery_remaining_str ("" once delivery is free or has no rule).
+    Arithmetic is done in integer cents; Decimals are built only for output.
     """
     cart = get_cart()
-    subtotal = sum(Decimal(v["price"]) * v["qty"] for v in cart.values())
-    delivery = Decimal(delivery_cost_str or "0")
-    threshold = Decimal(free_threshold_str or "0")
-    if threshold > 0 and subtotal >= threshold:
-        delivery = Decimal("0")
-    item_count = sum(v["qty"] for v in cart.values())
+    subtotal = item_count = 0
+    for price, qty in zip(cart["prices"], cart["qtys"]):   # one pass for both
+        subtotal   += price * qty
+        item_count += qty
+    delivery, threshold = delivery_rule()
+    if threshold > 0 and subtotal >= threshold:   # 0 = no free-delivery rule
+        delivery = 0
+    total = subtotal + delivery
     return {
-        "subtotal":   subtotal,
-        "delivery":   delivery,
-        "total":      subtotal + delivery,
-        "item_count": item_count,
+        "subtotal":     from_cents(subtotal),
+        "delivery":     from_cents(delivery),
+        "total":        from_cents(total),
+        "item_count":   item_count,
+        # Display strings, formatted once here rather than in each template
+        "subtotal_str": _cents_str(subtotal),
+        "delivery_str": _cents_str(delivery),
+        "total_str":    _cents_str(total),
+        "free_delivery_remaining_str":
+            _cents_str(threshold - subtotal) if delivery and threshold > 0 else "",
     }
 
 
@@ -165,7 +475,222 @@ def cart_totals(delivery_cost_str: str, free_threshold_str: str) -> dict:
 # Site settings convenience loader
 # ---------------------------------------------------------------------------
 
+# Settings change only through the admin, so they are shared across
+# requests in-process.  Writes bump `version` and drop the data.  Other
+# worker processes notice via the SETTINGS_VERSION_KEY row: once the TTL
+# lapses, one single-row lookup decides whether to reload the dict.
+SETTINGS_CACHE_TTL = 10  # seconds between version checks
+_SETTINGS_CACHE = {"version": 0, "data": None, "expires": 0.0}
+
+
 def get_settings() -> dict:
-    """Return all SiteSettings as a plain dict (used in template context)."""
-    from app.models import SiteSettings
-    return {row.key: row.value for row in SiteSettings.query.all()}
+    """
+    Return all SiteSettings as a plain dict (used in template context).
+    Served from the process-wide cache, memoised on `g` for the request.
+    """
+    cached = getattr(g, "_site_settings", None)
+    if cached is not None:
+        return cached
+
+    now = time.monotonic()
+    cached = _SETTINGS_CACHE["data"]
+    if cached is None or now >= _SETTINGS_CACHE["expires"]:
+        from app.models import SiteSettings, SETTINGS_VERSION_KEY
+        version = _SETTINGS_CACHE["version"]
+        if (cached is not None and SiteSettings.get(SETTINGS_VERSION_KEY)
+                == cached.get(SETTINGS_VERSION_KEY, "")):
+            # No writes anywhere since this copy was loaded
+            _SETTINGS_CACHE["expires"] = now + SETTINGS_CACHE_TTL
+        else:
+            cached = SiteSettings.as_dict()
+            # Don't publish a result that raced with a concurrent write
+            if version == _SETTINGS_CACHE["version"]:
+                _SETTINGS_CACHE.update(data=cached, expires=now + SETTINGS_CACHE_TTL)
+
+    g._site_settings = cached
+    return cached
+
+
+def invalidate_settings_cache() -> None:
+    """Drop cached settings after a write so the next read sees it."""
+    _SETTINGS_CACHE["version"] += 1
+    _SETTINGS_CACHE["data"] = None
+    g.pop("_site_settings", None)
+
+
+# ---------------------------------------------------------------------------
+# Homepage product lists (featured / deals)
+# ---------------------------------------------------------------------------
+
+# Both lists change only through admin product/category writes, which call
+# invalidate_product_lists(); the TTL covers other worker processes.
+# Entries are plain dicts with the fields _product_card.html reads.
+PRODUCT_LISTS_TTL = 60  # seconds
+_PRODUCT_LISTS = {"version": 0, "data": None, "expires": 0.0}
+
+
+def _card_dict(p) -> dict:
+    return {
+        "id":               p.id,
+        "slug":             p.slug,
+        "name":             p.name,
+        "image":            p.image,
+        "stock":            p.stock,
+        "is_deal":          p.is_deal,
+        "original_price":   p.original_price,
+        "discounted_price": p.discounted_price,
+        "deal_price":       p.deal_price,
+        "price_cents":      p.active_price_cents,
+        "discount_percent": p.discount_percent,
+        "category":         {"name": p.category.name} if p.category else None,
+    }
+
+
+def homepage_product_lists() -> tuple[list, list]:
+    """Return (featured, deals), up to 8 each, newest first."""
+    now = time.monotonic()
+    cached = _PRODUCT_LISTS["data"]
+    if cached is None or now >= _PRODUCT_LISTS["expires"]:
+        from app.models import Product, product_list_options
+        version = _PRODUCT_LISTS["version"]
+        cached = tuple(
+            [_card_dict(p) for p in
+             Product.query.options(*product_list_options())
+                          .filter_by(is_active=True, **{flag: True})
+                          .order_by(Product.created_at.desc())
+                          .limit(8).all()]
+            for flag in ("is_featured", "is_deal")
+        )
+        if version == _PRODUCT_LISTS["version"]:
+            _PRODUCT_LISTS.update(data=cached, expires=now + PRODUCT_LISTS_TTL)
+    return cached
+
+
+def invalidate_product_lists() -> None:
+    """Drop the cached homepage lists after a product write."""
+    _PRODUCT_LISTS["version"] += 1
+    _PRODUCT_LISTS["data"] = None
+
+
+# ---------------------------------------------------------------------------
+# Category slug lookup
+# ---------------------------------------------------------------------------
+
+# slug → id for the storefront category filter.  Admin category writes call
+# invalidate_category_slugs(); the TTL covers other worker processes.
+CATEGORY_SLUGS_TTL = 300  # seconds
+_CAT_BY_SLUG = {"version": 0, "data": None, "expires": 0.0}
+
+
+def category_id_for(slug: str):
+    """Return the id of the category with this slug, or None."""
+    now = time.monotonic()
+    cached = _CAT_BY_SLUG["data"]
+    if cached is None or now >= _CAT_BY_SLUG["expires"]:
+        from app import db
+        from app.models import Category
+        version = _CAT_BY_SLUG["version"]
+        cached = dict(db.session.query(Category.slug, Category.id).all())
+        if version == _CAT_BY_SLUG["version"]:
+            _CAT_BY_SLUG.update(data=cached, expires=now + CATEGORY_SLUGS_TTL)
+    return cached.get(slug)
+
+
+def invalidate_category_slugs() -> None:
+    """Drop the slug map after a category is added or removed."""
+    _CAT_BY_SLUG["version"] += 1
+    _CAT_BY_SLUG["data"] = None
+
+
+# ---------------------------------------------------------------------------
+# Keyset pagination
+# ---------------------------------------------------------------------------
+
+# Old ?page=N links keep working (via OFFSET) for the first few pages only
+LEGACY_PAGE_LIMIT = 5
+
+
+class KeysetPage:
+    """One page of newest-first results plus the cursor for the next page."""
+
+    def __init__(self, items: list, has_next: bool, is_first: bool):
+        self.items    = items
+        self.has_next = has_next
+        self.is_first = is_first
+
+    @property
+    def next_args(self) -> dict:
+        """Query-string arguments that select the following page."""
+        last = self.items[-1]
+        return {"after_ts": last.created_at.isoformat(), "after_id": last.id}
+
+
+def keyset_paginate(query, model, per_page: int = 20) -> KeysetPage:
+    """
+    Page `query` by (created_at DESC, id DESC) using the ?after_ts=&after_id=
+    cursor from the request.  Each page costs one LIMIT query regardless of
+    depth — no COUNT(*) and no OFFSET scan.
+    """
+    after_ts = request.args.get("after_ts", "")
+    after_id = request.args.get("after_id", 0, type=int)
+    page     = request.args.get("page", 1, type=int)
+
+    query = query.order_by(model.created_at.desc(), model.id.desc())
+
+    cursor = None
+    if after_ts and after_id:
+        try:
+            cursor = datetime.fromisoformat(after_ts)
+        except ValueError:
+            cursor = None
+
+    if cursor is not None:
+        query = query.filter(or_(
+            model.created_at < cursor,
+            and_(model.created_at == cursor, model.id < after_id),
+        ))
+    elif 1 < page <= LEGACY_PAGE_LIMIT:
+        query = query.offset((page - 1) * per_page)
+    else:
+        page = 1
+
+    rows = query.limit(per_page + 1).all()
+    return KeysetPage(rows[:per_page],
+                      has_next=len(rows) > per_page,
+                      is_first=cursor is None and page == 1)
+
+
+# ---------------------------------------------------------------------------
+# Full-text search
+# ---------------------------------------------------------------------------
+
+_FTS_TOKEN = re.compile(r"\w+")
+
+
+def fts_match_ids(table: str, q: str, limit: int = 500) -> list[int] | None:
+    """
+    Return ids from `<table>_fts` whose indexed columns match every word of
+    `q` as a prefix, newest (highest id) first, so the `limit` cut drops the
+    oldest matches rather than arbitrary ones before the caller's newest-first
+    keyset paging.  Returns None when full-text search is unavailable
+    (non-SQLite database or missing FTS5 table) so callers can fall back
+    to ILIKE.
+    """
+    from app import db
+    if db.engine.dialect.name != "sqlite":
+        return None
+
+    tokens = _FTS_TOKEN.findall(q)
+    if not tokens:
+        return []
+    match = " ".join(f'"{t}"*' for t in tokens)
+    try:
+        rows = db.session.execute(
+            text(f"SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH :q "
+                 f"ORDER BY rowid DESC LIMIT :n"),
+            {"q": match, "n": limit},
+        )
+    except OperationalError:
+        db.session.rollback()
+        return None
+    return [r[0] for r in rows]
@@ -0,0 +1,58 @@
+"""
+Round-trip checks for the msgpack session cookie interface.
+"""
+
+from decimal import Decimal
+
+import pytest
+from flask import Flask, jsonify, session
+
+pytest.importorskip("msgpack")
+
+from app.sessions import MsgpackSessionInterface
+
+
+@pytest.fixture()
+def client():
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "test-secret"
+    app.session_interface = MsgpackSessionInterface()
+
+    @app.route("/write")
+    def write():
+        session["cart"] = {"pids": [1, 2], "qtys": [2, 1], "prices": [1999, 500]}
+        session["_user_id"] = "1"
+        session["total"] = Decimal("44.98")
+        return "ok"
+
+    @app.route("/read")
+    def read():
+        return jsonify(cart=session.get("cart"),
+                       user=session.get("_user_id"),
+                       total=str(session.get("total")))
+
+    return app.test_client()
+
+
+def test_cart_write_sets_a_text_cookie(client):
+    response = client.get("/write")
+    assert response.status_code == 200
+    cookie = client.get_cookie("session")
+    assert cookie is not None and cookie.value.isascii()
+
+
+def test_cart_round_trips_through_the_cookie(client):
+    client.get("/write")
+    data = client.get("/read").get_json()
+    assert data["cart"] == {"pids": [1, 2], "qtys": [2, 1], "prices": [1999, 500]}
+    assert data["user"] == "1"
+    assert data["total"] == "44.98"
+
+
+def test_json_cookie_from_an_older_deploy_starts_a_fresh_session(client):
+    from flask.sessions import SecureCookieSessionInterface
+
+    app = client.application
+    legacy = SecureCookieSessionInterface().get_signing_serializer(app)
+    client.set_cookie("session", legacy.dumps({"_user_id": "1"}))
+    assert client.get("/read").get_json()["user"] is None